@@ -18,41 +18,50 @@ class Data:
     self.num_deposits = 0
     self.withdrew = 0
     self.deposited = 0
+    # Each list of values is kept along with a list of the 1-based indices
+    # at which they were added, so that lost updates can be detected.
     self.withdrawals = []
+    self.withdrawals_ixs = []
     self.failed_withdrawals = []
+    self.failed_withdrawals_ixs = []
     self.deposits = []
+    self.deposits_ixs = []
 
-  def _add_list_entry (self, lst, val):
-    ix = len (lst) + 1
-    lst.append ({'value': val, 'index': ix})
+  def _add_list_entry (self, values, ixs, val):
+    values.append (val)
+    ixs.append (len (ixs) + 1)
 
   def _check_list (self, name):
-    ixs = set ([])
-    lst = getattr (self, name)
-
-    for elem in lst:
-      if elem['index'] in ixs:
-        raise RuntimeError ('found duplicate index for list %s' % name)
-      ixs.add (elem['index'])
-
-    if lst and lst[-1]['index'] != len (lst):
+    # Work on plain copies, so that the distributed lists are only
+    # accessed once. The values are returned for further checks.
+    values = list (getattr (self, name))
+    ixs = list (getattr (self, name + '_ixs'))
+
+    if len (values) != len (ixs):
+      raise RuntimeError ('inconsistent indices for list %s' % name)
+    elif len (set (ixs)) != len (ixs):
+      raise RuntimeError ('found duplicate index for list %s' % name)
+    elif ixs and ixs[-1] != len (ixs):
       raise RuntimeError ('inconsistent length for list %s' % name)
 
+    return values
+
   def withdraw (self, num):
     if self.balance > num:
       self.balance -= num
       self.withdrew += num
       self.num_withdrawals += 1
-      self._add_list_entry (self.withdrawals, num)
+      self._add_list_entry (self.withdrawals, self.withdrawals_ixs, num)
     else:
       self.num_failed_withdrawals += 1
-      self._add_list_entry (self.failed_withdrawals, num)
+      self._add_list_entry (self.failed_withdrawals,
+                            self.failed_withdrawals_ixs, num)
 
   def deposit (self, num):
     self.balance += num
     self.deposited += num
     self.num_deposits += 1
-    self._add_list_entry (self.deposits, num)
+    self._add_list_entry (self.deposits, self.deposits_ixs, num)
 
   def check (self):
     if self.balance < 0:
@@ -64,9 +73,17 @@ class Data:
     if self.orig_balance + self.deposited < self.withdrew:
       raise RuntimeError ('inconsistent balance')
 
-    self._check_list ('withdrawals')
-    self._check_list ('failed_withdrawals')
-    self._check_list ('deposits')
+    withdrawals = self._check_list ('withdrawals')
+    failed_withdrawals = self._check_list ('failed_withdrawals')
+    deposits = self._check_list ('deposits')
+
+    if (len (withdrawals) != self.num_withdrawals or
+        len (failed_withdrawals) != self.num_failed_withdrawals or
+        len (deposits) != self.num_deposits):
+      raise RuntimeError ('inconsistent counters')
+    elif (sum (withdrawals) != self.withdrew or
+          sum (deposits) != self.deposited):
+      raise RuntimeError ('inconsistent totals')
 
 FACTOR = 10000.
 
@@ -93,9 +110,10 @@ def run (mgr, fd):
     xsleep (val / FACTOR)
 
   funcs = (deposit, withdraw, check)
+  rand = random.random
 
   while True:
-    val = int (FACTOR * random.random ())
+    val = int (FACTOR * rand ())
     funcs[val % 3] (val)
 
 def main ():
@@ -3,8 +3,14 @@ import tosc
 import pytest
 
 import collections
+import copy
+import gc
+import os
+import struct
+import sys
 import threading
 import time
+import weakref
 
 def _make_mgr ():
   return tosc.Manager (tosc.InprocBackend ())
@@ -26,6 +32,9 @@ def test_dlist_api ():
   x.append (4)
   assert x == [1, 2, 3, 4]
   assert x.copy () == [1, 2, 3, 4]
+  assert type (copy.copy (x)) is list
+  assert copy.copy (x) == [1, 2, 3, 4]
+  assert weakref.ref(x) () is x
   x.extend ([3, 4])
   assert x.count (1) == 1
   assert x.count (3) == 2
@@ -161,11 +170,28 @@ def test_pickle_custom ():
   c = Custom ('abc', [33])
   mgr.write (c)
   c2 = mgr.read ()
+  assert vars (c2) == {}
   c2.y[0] -= 33
   c.y[0] -= 33
   c.x = c2.x = '???'
   assert c2.fn (-1) == c.fn (-1)
 
+def test_any_types_released ():
+  from tosc.dpickler import _make_any
+
+  class Local:
+    pass
+
+  obj = _make_any (Local, {'x': 1}, _make_mgr (), None)
+  assert isinstance (obj, Local) and obj.x == 1
+  wtype = weakref.ref (Local)
+  del Local, obj
+  # The first pass collects the distributed type, which drops the cache
+  # entry; the second one collects the original type.
+  gc.collect ()
+  gc.collect ()
+  assert wtype () is None
+
 def test_try_write ():
   mgr = _make_mgr ()
   assert mgr.try_write ({'a': 1, 'b': None}, None)
@@ -283,3 +309,234 @@ def test_extension_types ():
   new.append (None)
   assert mgr.read () == new
   assert new[-1] is None
+
+def test_file_backend (tmp_path):
+  backend = tosc.FileBackend (str (tmp_path / 'data'))
+  backend.set_id (b'x' * 32)
+  assert backend.read () == (None, None)
+  assert backend.write (b'abc') == 1
+  # Same payload - Only the header is replaced.
+  assert backend.write (b'abc') == 2
+  assert backend.read () == (2, b'abc')
+  assert backend.try_write (b'abd', 2) == (True, 3)
+  assert backend.try_write (b'abcdef', 2) == (False, 3)
+  assert backend.read () == (3, b'abd')
+
+  mgr = tosc.Manager (backend.copy ())
+  mgr.write ({'a': 1})
+  assert mgr.read () == {'a': 1}
+
+def test_large_bytearray ():
+  mgr = _make_mgr ()
+  obj = [bytearray (b'abc' * 100000), bytearray (b'def' * 100000), 'xyz']
+  mgr.write (obj)
+  new = mgr.refresh ()
+  assert new == obj
+  assert isinstance (new[0], tosc.DByteArray)
+  new[1][0] = 0
+  assert mgr.refresh ()[1][0] == 0
+  tst_dpickler (mgr, obj)
+
+def test_oob_framing ():
+  from tosc.manager import _OOB_MIN_SIZE
+  sizes = (_OOB_MIN_SIZE - 1, _OOB_MIN_SIZE, _OOB_MIN_SIZE + 1, 10)
+  obj = [bytearray ([ix]) * size for ix, size in enumerate (sizes)]
+  payload = _make_mgr().dump (obj)
+
+  # Only the buffers of at least '_OOB_MIN_SIZE' bytes are out-of-band.
+  tag, nbufs = struct.unpack_from ("<BI", payload)
+  assert (tag, nbufs) == (0, 2)
+  lens = struct.unpack_from ("<3Q", payload, 5)
+  assert lens[1:] == (_OOB_MIN_SIZE, _OOB_MIN_SIZE + 1)
+  assert len (payload) == 5 + 8 * 3 + sum (lens)
+  # The stream follows, pickled with protocol 5, as are plain payloads.
+  assert payload[5 + 8 * 3:][:2] == b'\x80\x05'
+  assert _make_mgr().dump ([1])[:2] == b'\x80\x05'
+
+  new = _make_mgr().load (payload)
+  assert new == obj
+  assert all (isinstance (x, tosc.DByteArray) for x in new)
+  # Loading also works on views, as returned by some backends.
+  assert _make_mgr().load (memoryview (payload)) == obj
+
+def test_pickle_custom_shared_type ():
+  mgr = _make_mgr ()
+  mgr.write (Custom (1, 2))
+  c1 = mgr.read ()
+  mgr.write (Custom (3, 4))
+  c2 = mgr.read ()
+  assert type (c1) is type (c2)
+  assert (c1.x, c1.y, c2.x, c2.y) == (1, 2, 3, 4)
+  c2.x = -1
+  assert mgr.refresh () == Custom (-1, 4)
+  assert c1.x == 1
+
+def test_file_backend_torn_header (tmp_path, monkeypatch):
+  backend = tosc.FileBackend (str (tmp_path / 'data'))
+  backend.set_id (b'x' * 32)
+  backend.write (b'abc')
+
+  # Make the first header read look like a partial, concurrent write.
+  pread = os.pread
+  reads = []
+  def _pread (fd, size, off):
+    ret = pread (fd, size, off)
+    reads.append (ret)
+    return ret if len (reads) > 1 else b'\xff' + ret[1:]
+
+  monkeypatch.setattr (os, 'pread', _pread)
+  assert backend.read () == (1, b'abc')
+  assert len (reads) == 4
+
+def test_file_backend_lock (tmp_path):
+  backend = tosc.FileBackend (str (tmp_path / 'data'))
+  backend.set_id (b'x' * 32)
+  other = backend.copy ()
+  other.set_id (b'y' * 32)
+  backend.exclusive_lock ()
+  # The lock is reentrant for the owner.
+  assert backend.write (b'abc') == 1
+
+  thr = threading.Thread (target = other.write, args = (b'def',),
+                          daemon = True)
+  thr.start ()
+  thr.join (0.2)
+  assert thr.is_alive ()
+  assert backend.read () == (1, b'abc')
+
+  backend.exclusive_unlock ()
+  thr.join ()
+  assert other.read () == (2, b'def')
+
+def test_watcher_exit ():
+  backend = tosc.InprocBackend ()
+  mgr = tosc.Manager (backend.copy ())
+  watcher = mgr.watcher
+  wmgr = weakref.ref (mgr)
+  del mgr
+  gc.collect ()
+  assert wmgr () is None
+
+  # Wake up the watcher so it notices its Manager is gone.
+  tosc.Manager(backend).write ([1])
+  watcher.join (1)
+  assert not watcher.is_alive ()
+
+def test_skip_unchanged ():
+  backend = tosc.InprocBackend ()
+  mgr = tosc.Manager (backend, skip_unchanged = True)
+  mgr.write ([1, 2, 3])
+  version = backend.data.version
+
+  # Sorting an already sorted list doesn't change it.
+  mgr.read().sort ()
+  assert backend.data.version == version
+
+  mgr.read().reverse ()
+  assert backend.data.version == version + 1
+  assert mgr.read () == [3, 2, 1]
+
+  # Values that compare equal but are distinct still get written.
+  other = tosc.Manager (backend.copy ())
+  mgr.write ([1])
+  for value in (1.0, True, 1):
+    version = backend.data.version
+    mgr.read()[0] = value
+    assert backend.data.version == version + 1
+    assert type (other.refresh ()[0]) is type (value)
+
+  mgr.write ([{'x': 0.0}])
+  mgr.read()[0]['x'] = -0.0
+  assert str (other.refresh ()[0]['x']) == '-0.0'
+
+def test_dbuiltin_attrs ():
+  class MyList (tosc.DList):
+    pass
+
+  assert MyList ([1, 2]) == [1, 2]
+
+  backend = tosc.InprocBackend ()
+  mgr = tosc.Manager (backend)
+  mgr.write ([{1, 2}])
+  x = mgr.read()[0]
+  x -= {1}
+  assert tosc.Manager(backend.copy ()).read () == [{2}]
+
+@pytest.mark.skipif (sys.version_info < (3, 12),
+                     reason = 'buffer protocol requires Python 3.12')
+def test_dbytearray_buffer ():
+  mgr = _make_mgr ()
+  mgr.write ([bytearray (b'abcdef')])
+  x = mgr.read()[0]
+  assert isinstance (x, tosc.DByteArray)
+  with memoryview (x) as view:
+    assert view.tobytes () == b'abcdef'
+  assert b''.join ([x]) == b'abcdef'
+
+class _RefreshOnGet (dict):
+  "Object map that refreshes its Manager on the first lookup."
+
+  def __init__ (self, mgr):
+    super().__init__ (mgr.objmap)
+    self.mgr = mgr
+
+  def get (self, *args):
+    mgr, self.mgr = self.mgr, None
+    if mgr is not None:
+      mgr.refresh ()
+    return super().get (*args)
+
+def test_stale_handle_mutation ():
+  backend = tosc.InprocBackend ()
+  mgr = tosc.Manager (backend)
+  # Stop the watcher so that only the test refreshes the Manager.
+  mgr._stop.set ()
+  mgr.write ([[1]])
+  mgr.watcher.join (1)
+  handle = mgr.read()[0]
+
+  other = tosc.Manager (backend.copy ())
+  other.read()[0].append (2)
+  mgr.refresh ()
+  other.read()[0].append (3)
+
+  # Mutate through the old handle, with another refresh landing in
+  # the middle of the call.
+  mgr.objmap = _RefreshOnGet (mgr)
+  handle.append (4)
+  assert tosc.Manager(backend.copy ()).read () == [[1, 2, 3, 4]]
+
+def test_concurrent_dump ():
+  mgr = _make_mgr ()
+  payloads = [[] for _ in range (8)]
+
+  def _dump (ix):
+    obj = [ix] * 1000
+    for _ in range (50):
+      payloads[ix].append (mgr.dump (obj))
+
+  threads = [threading.Thread (target = _dump, args = (ix,))
+             for ix in range (len (payloads))]
+  for thr in threads:
+    thr.start ()
+  for thr in threads:
+    thr.join ()
+
+  checker = _make_mgr ()
+  for ix, lst in enumerate (payloads):
+    for payload in lst:
+      assert checker.load (payload) == [ix] * 1000
+
+class SingleSlot:
+  __slots__ = 'value'
+
+  def __init__ (self, value):
+    self.value = value
+
+def test_pickle_single_slot ():
+  mgr = _make_mgr ()
+  mgr.write (SingleSlot ([1, 2]))
+  obj = mgr.read ()
+  assert obj.value == [1, 2]
+  obj.value = 'abc'
+  assert mgr.refresh().value == 'abc'
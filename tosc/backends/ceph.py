@@ -1,9 +1,19 @@
 from .base import BaseBackend
 from rados import (Rados, ObjectNotFound, ObjectExists, OSError as RadosError)
-from struct import pack, unpack_from
-from threading import Condition, Lock
+from struct import Struct
+from threading import Event, Lock
 from time import sleep
 
+# Initial number of bytes to read. This is adjusted to the size of the
+# stored object as it's read and written.
+_DFL_READ_SIZE = 8192
+
+# Maximum time in seconds to wait for a notification.
+_WAIT_TIMEOUT = 5
+
+# Header of the stored object: the payload size.
+_SIZE = Struct ("<Q")
+
 def _on_write (comp, retval, ack_list, timeouts):
   # Nothing to do.
   pass
@@ -34,9 +44,10 @@ class CephBackend (BaseBackend):
     self.obj_name = obj_name
     self.max_retries = max_retries
     self.lock = Lock ()
-    self.cond = Condition (self.lock)
+    self.recv_ev = Event ()
     self.recv_id = None
     self.watch = None
+    self.read_size = _DFL_READ_SIZE
 
     self._watch ()
     try:
@@ -85,22 +96,31 @@ class CephBackend (BaseBackend):
     self.cluster = None
 
   def _update_version (self):
+    # This doesn't involve a round-trip to the cluster: librados keeps the
+    # version of the last operation made through the I/O context. It must
+    # be fetched after each one, however, since it's what ties the data
+    # that was read or written to its version.
     self.version = self.ioctx.get_last_version ()
     return self.version
 
   def read (self):
+    # Instead of calling 'stat' to get the object size, read as much as
+    # the last known size. If the object has grown since, the header
+    # tells us how much we have to read on the next try.
     n = self.max_retries
+    size = self.read_size
     while n >= 0:
       n -= 1
       try:
-        size = self.ioctx.stat(self.obj_name)[0]
-        ret = memoryview (self.ioctx.read (self.obj_name, size))
-        obj_size = unpack_from("<Q", ret)[0]
-        if obj_size + 8 <= size:
-          return (self._update_version (), ret[8:obj_size + 8])
+        ret = self.ioctx.read (self.obj_name, size)
       except ObjectNotFound:
         return (None, None)
 
+      size = _SIZE.unpack_from (ret)[0] + 8
+      if size <= len (ret):
+        self.read_size = size
+        return (self._update_version (), memoryview (ret)[8:size])
+
     raise RuntimeError ('failed to get RADOS object')
 
   def _notify (self):
@@ -118,7 +138,8 @@ class CephBackend (BaseBackend):
     return ret
 
   def write (self, new):
-    self.ioctx.write_full (self.obj_name, pack ("<Q", len (new)) + new)
+    self.read_size = len (new) + 8
+    self.ioctx.write_full (self.obj_name, _SIZE.pack (len (new)) + new)
     return self._notify ()
 
   def try_write (self, new, expected):
@@ -129,9 +150,11 @@ class CephBackend (BaseBackend):
       else:
         wop.new (1)
 
-      wop.write (pack ("<Q", len (new)))
-      wop.write (new, 8)
+      # Replacing the whole object also drops any leftover bytes from
+      # a previous, larger payload.
+      wop.write_full (_SIZE.pack (len (new)) + new)
       self.ioctx.operate_write_op (wop, self.obj_name)
+      self.read_size = len (new) + 8
       return (True, self._notify ())
     except (ObjectExists, RadosError):
       return (False, self._notify ())
@@ -139,12 +162,14 @@ class CephBackend (BaseBackend):
       wop.release ()
 
   def on_complete (self, notify_id, notifier, cookie, data):
-    if isinstance (data, bytes):
-      data = data.decode ('utf8')
+    # The unique id is bytes, and so is the payload librados hands us,
+    # but older bindings may pass it as a string.
+    if isinstance (data, str):
+      data = data.encode ('utf8')
     if data != self.unique_id:
       with self.lock:
         self.recv_id = data
-        self.cond.notify ()
+        self.recv_ev.set ()
 
   def on_notify_error (self, *_):
     # The error callback can be invoked on a network error or if the
@@ -156,16 +181,18 @@ class CephBackend (BaseBackend):
       pass
 
     self.watch = None
+    # Wake up the waiter so that it polls the object instead.
+    self.recv_ev.set ()
 
   def target_wait (self):
+    self.recv_ev.wait (_WAIT_TIMEOUT)
     with self.lock:
-      if self.recv_id is None:
-        self.cond.wait (5)
+      ret = self.recv_id
+      self.recv_id = None
+      self.recv_ev.clear ()
 
-      if self.recv_id is not None:
-        ret = self.recv_id
-        self.recv_id = None
-        return ret
+    if ret is not None:
+      return ret
 
     try:
       self.ioctx.stat (self.obj_name)
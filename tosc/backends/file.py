@@ -1,18 +1,29 @@
 from .base import BaseBackend
-from filelock import FileLock
 import os
-from struct import pack, unpack
-from subprocess import check_output, DEVNULL
-from tempfile import NamedTemporaryFile
-from time import sleep
+from select import select
+from struct import Struct
+from tempfile import mkstemp
+import threading
+from time import monotonic, sleep
 import sys
 
+try:
+  import fcntl
+except ImportError:
+  # Not available on Windows. The module can still be imported there, but
+  # the backend itself can't be used (see 'FileBackend.__init__').
+  fcntl = None
+
 # Time in seconds to sleep before polling for a FS event.
 # The selected value will depend on whether the filesystem is local or not.
 _DFL_STAT_INTERVAL = 5
 _MAX_STAT_INTERVAL = 30
 _MIN_STAT_INTERVAL = 0.2
 
+# Header of the stored file: version and unique ID of the last writer.
+_HEADER = Struct ("<Q32s")
+_VERSION = Struct ("<Q")
+
 _LOCAL_FS = frozenset ([
   0x1373,       # devfs
   0x4006,       # fat
@@ -28,58 +39,218 @@ _LOCAL_FS = frozenset ([
   0x58465342,   # xfs
 ])
 
-class _NamedTempfile:
-  def __init__ (self, dir):
-    self._file = NamedTemporaryFile (dir = dir)
+# Payloads up to this size are compared with the stored one, so that the
+# header alone is rewritten if they match. Larger ones are always written
+# anew, since comparing them means reading the whole file back.
+_INPLACE_MAX_SIZE = 64 * 1024
+
+# Neither of these is available everywhere (i.e: macOS).
+_fdatasync = getattr (os, 'fdatasync', os.fsync)
+_fallocate = getattr (os, 'posix_fallocate', None)
+
+def _read_stored (file, payload = True):
+  """
+  Read the header fields of the stored file and, if `payload` is true, the
+  data after them. Returns a tuple of ((VERSION, UID), DATA).
+  """
+  fd = file.fileno ()
+  while True:
+    header = os.pread (fd, _HEADER.size, 0)
+    data = None
+    if payload:
+      file.seek (_HEADER.size)
+      data = file.read ()
+    # Readers don't take the lock, and the header may be rewritten in
+    # place (see 'FileBackend._write_inplace'). Reading it again after
+    # the rest makes sure it didn't change in the meantime - If it did,
+    # the first read may have seen a partial write.
+    if os.pread (fd, _HEADER.size, 0) == header:
+      return (_HEADER.unpack (header), data)
+
+# Stat intervals for the directories seen so far.
+_STAT_INTERVALS = {}
+
+# Events to watch for in the directory of the stored file: It's either
+# replaced (by renaming a tempfile) or its header is modified in place.
+_IN_MODIFY = 0x2
+_IN_MOVED_TO = 0x80
+
+# struct inotify_event: wd, mask, cookie, len - Followed by the name.
+_INOTIFY_EVENT = Struct ("iIII")
+
+try:
+  if not sys.platform.startswith ('linux'):
+    raise ImportError ('statfs magic numbers and inotify are Linux-specific')
+
+  import ctypes
+
+  class _StatfsBuf (ctypes.Structure):
+    # Only the leading 'f_type' member is of interest. The padding
+    # covers the rest of 'struct statfs'.
+    _fields_ = [('f_type', ctypes.c_long), ('pad', ctypes.c_byte * 256)]
+
+  _libc = ctypes.CDLL(None, use_errno = True)
+  _statfs = _libc.statfs
+  _statfs.argtypes = (ctypes.c_char_p, ctypes.POINTER (_StatfsBuf))
+  _inotify_init1 = _libc.inotify_init1
+  _inotify_init1.argtypes = (ctypes.c_int,)
+  _inotify_add_watch = _libc.inotify_add_watch
+  _inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p,
+                                 ctypes.c_uint32)
+except Exception:
+  _statfs = _inotify_init1 = None
+
+def _inotify_watch (path):
+  "Get an inotify descriptor watching the directory `path`, or None."
+  if _inotify_init1 is None:
+    return None
+
+  fd = _inotify_init1 (os.O_CLOEXEC | os.O_NONBLOCK)
+  if fd < 0:
+    return None
+  elif _inotify_add_watch (fd, os.fsencode (path),
+                           _IN_MODIFY | _IN_MOVED_TO) < 0:
+    os.close (fd)
+    return None
+  return fd
+
+def _inotify_names (fd):
+  "Consume the pending events on an inotify descriptor and get the names."
+  ret = set ()
+  try:
+    buf = os.read (fd, 65536)
+  except BlockingIOError:
+    return ret
+
+  off = 0
+  while off < len (buf):
+    size = _INOTIFY_EVENT.unpack_from (buf, off)[3]
+    off += _INOTIFY_EVENT.size
+    ret.add (buf[off:off + size].rstrip (b'\0'))
+    off += size
+  return ret
+
+def _stat_interval (path):
+  "Get the stat interval to use for files in the directory `path`."
+  ret = _STAT_INTERVALS.get (path)
+  if ret is None:
+    buf = _StatfsBuf ()
+    if _statfs (os.fsencode (path), ctypes.byref (buf)) != 0:
+      return _DFL_STAT_INTERVAL
+    elif (buf.f_type & 0xffffffff) in _LOCAL_FS:
+      ret = _MIN_STAT_INTERVAL
+    else:
+      ret = _MAX_STAT_INTERVAL
+    _STAT_INTERVALS[path] = ret
+  return ret
+
+if hasattr (fcntl, 'F_OFD_SETLKW'):
+  # struct flock: l_type, l_whence, l_start, l_len, l_pid
+  _FLOCK = Struct ("hhqqi")
+
+  def _lock_fd (fd, lock):
+    ltype = fcntl.F_WRLCK if lock else fcntl.F_UNLCK
+    fcntl.fcntl (fd, fcntl.F_OFD_SETLKW, _FLOCK.pack (ltype, 0, 0, 0, 0))
+elif fcntl is not None:
+  # BSD locks are also bound to the open file description.
+  def _lock_fd (fd, lock):
+    fcntl.flock (fd, fcntl.LOCK_EX if lock else fcntl.LOCK_UN)
+
+class _FileLock:
+  """
+  Reentrant lock that excludes both the other threads in this process and
+  other processes. The latter is done by locking an open file description
+  for `path`, which is kept for as long as the lock lives.
+  """
+
+  def __init__ (self, path):
+    self.path = path
+    self.fd = None
+    self.pid = None
+    self.depth = 0
+    # Threads share the file description, so they need their own lock.
+    self.rlock = threading.RLock ()
+
+  def acquire (self):
+    self.rlock.acquire ()
+    try:
+      pid = os.getpid ()
+      if self.pid != pid:
+        # Forked children share the file description with their
+        # parent, so each process needs to open its own.
+        self._close ()
+        self.fd = os.open (self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.pid = pid
+        self.depth = 0
+
+      if self.depth == 0:
+        _lock_fd (self.fd, True)
+    except BaseException:
+      self.rlock.release ()
+      raise
+
+    self.depth += 1
+    return True
+
+  def release (self):
+    if self.depth == 1:
+      _lock_fd (self.fd, False)
+    self.depth -= 1
+    self.rlock.release ()
+
+  def _close (self):
+    if self.fd is not None:
+      os.close (self.fd)
+      self.fd = None
 
   def __enter__ (self):
-    return self._file.__enter__ ()
+    self.acquire ()
+    return self
+
+  def __exit__ (self, *_):
+    self.release ()
 
-  def __exit__ (self, *args):
+  def __del__ (self):
     try:
-      # The tempfile was renamed and no longer exists.
-      # On older Python versions, this caused issues,
-      # so patch it out here.
-      self._file.__exit__ (*args)
-    except FileNotFoundError:
+      self._close ()
+    except Exception:
       pass
 
+def _write_all (fd, bufs):
+  "Write the buffers in `bufs` to the file descriptor `fd`."
+  nbytes = os.writev (fd, bufs)
+  if nbytes < sum (len (buf) for buf in bufs):
+    # Short write - Handle the rest with plain writes.
+    rest = memoryview (b''.join (bufs))[nbytes:]
+    while rest:
+      rest = rest[os.write (fd, rest):]
+
 class FileBackend (BaseBackend):
   def __init__ (self, path, lock_path = None):
+    if fcntl is None:
+      raise NotImplementedError ('FileBackend requires fcntl-based file '
+                                 'locking, which this platform lacks')
+
     super().__init__ ()
     self.path = path
     self._last_modified = None
     self.lock_path = lock_path or (path + '.lock')
-    self.lock = FileLock (self.lock_path)
+    self.lock = _FileLock (self.lock_path)
     self._start ()
     self.interval = _DFL_STAT_INTERVAL
     self.dir_path = os.path.dirname (path) or '.'
+    self.inotify_fd = None
+    self.inotify_pid = None
 
-    if os.name == 'posix':
-      self._determine_stat_interval ()
+    if _statfs is not None:
+      self.interval = _stat_interval (self.dir_path)
 
-  def _tempfile (self):
-    return _NamedTempfile (self.dir_path)
+    # Only replace the header in place on local filesystems. See below.
+    self.local_fs = self.interval == _MIN_STAT_INTERVAL
 
   def copy (self):
     return FileBackend (self.path, self.lock_path)
 
-  def _determine_stat_interval (self):
-    try:
-      # XXX: Using statfs would be much easier, but unfortunately,
-      # the interface in the std lib doesn't have access to the
-      # 'f_type' member, which is what we need.
-      ret = check_output (['stat', '-f', '-c', '%t',
-                          os.path.dirname (self.path)],
-                          text = True, stderr = DEVNULL)
-      fstype = int (ret.strip (), 16)
-      if fstype in _LOCAL_FS:
-        self.interval = _MIN_STAT_INTERVAL
-      else:
-        self.interval = _MAX_STAT_INTERVAL
-    except Exception:
-      pass
-
   def _start (self):
     try:
       self._last_modified = os.stat(self.path).st_mtime
@@ -88,51 +259,142 @@ class FileBackend (BaseBackend):
 
   def _get_version (self):
     try:
-      with open (self.path, 'rb') as f:
-        return unpack("<Q", f.read (8))[0]
+      fd = os.open (self.path, os.O_RDONLY)
     except FileNotFoundError:
       return 0
 
+    try:
+      # The descriptor is fresh, so this reads from the start.
+      return _VERSION.unpack (os.read (fd, 8))[0]
+    finally:
+      os.close (fd)
+
   def read (self):
     try:
       with open (self.path, 'rb') as file:
-        version, _ = unpack ("<Q32s", file.read (40))
-        return (version, file.read ())
+        (version, _), data = _read_stored (file)
+        return (version, data)
     except FileNotFoundError:
       return (None, None)
 
   def link (self, tpath):
     os.rename (tpath, self.path)
 
+  def _write_inplace (self, new, version):
+    """
+    If the stored payload is the same as `new`, only replace the header
+    in place. Returns True if that was the case. Must be called with the
+    lock held.
+    """
+    # This gives up the atomic replacement that renaming provides, which
+    # is fine because the payload doesn't change: Readers get either the
+    # old version or the new one for the same data, both of which are
+    # correct. POSIX doesn't guarantee that concurrent readers see the
+    # header write as a whole, so they check that the header didn't
+    # change while they read (see '_read_stored'). Network filesystems
+    # like NFS cache file contents on each client with loose coherence,
+    # so renaming remains the only way to replace the file there.
+    if not self.local_fs or len (new) > _INPLACE_MAX_SIZE:
+      return False
+
+    try:
+      fd = os.open (self.path, os.O_RDWR)
+    except FileNotFoundError:
+      return False
+
+    try:
+      size = len (new)
+      if (os.fstat(fd).st_size != size + 40 or
+          os.pread (fd, size, 40) != new):
+        return False
+
+      os.pwrite (fd, _HEADER.pack (version, self.unique_id), 0)
+      _fdatasync (fd)
+      return True
+    finally:
+      os.close (fd)
+
+  def _write_new (self, new, version):
+    fd, tpath = mkstemp (dir = self.dir_path)
+    try:
+      if _fallocate is not None:
+        try:
+          # Preallocating the file lets the filesystem lay out the
+          # blocks in one go instead of growing it on each write.
+          _fallocate (fd, 0, len (new) + 40)
+        except OSError:
+          pass
+
+      # The tempfile is written through its raw descriptor and renamed
+      # over the stored file without syncing it first: The rename is what
+      # makes the replacement atomic for readers, not the sync.
+      _write_all (fd, [_HEADER.pack (version, self.unique_id), new])
+      self.link (tpath)
+    except Exception:
+      os.unlink (tpath)
+      raise
+    finally:
+      os.close (fd)
+
   def write (self, new):
-    with self.lock, self._tempfile () as fm:
+    with self.lock:
       version = self._get_version () + 1
-      fm.write (pack ("<Q32s", version, self.unique_id))
-      fm.write (new)
-      self.link (fm.name)
+      if not self._write_inplace (new, version):
+        self._write_new (new, version)
       return version
 
   def try_write (self, new, expected):
     if expected is None:
       expected = 0
 
-    with self.lock, self._tempfile () as fm:
+    with self.lock:
       version = self._get_version ()
       if version != expected:
         return (False, version)
 
       expected += 1
-      fm.write (pack ("<Q32s", expected, self.unique_id))
-      fm.write (new)
-      self.link (fm.name)
+      if not self._write_inplace (new, expected):
+        self._write_new (new, expected)
       return (True, expected)
 
+  def __del__ (self):
+    fd = getattr (self, 'inotify_fd', None)
+    if fd is not None and self.inotify_pid == os.getpid ():
+      try:
+        os.close (fd)
+      except Exception:
+        pass
+
+  def _wait_change (self):
+    "Wait until the stored file changes, or the stat interval elapses."
+    pid = os.getpid ()
+    if self.inotify_pid != pid:
+      # Inotify descriptors inherited from the parent would share
+      # its events, so every process has to set up its own.
+      self.inotify_pid = pid
+      self.inotify_fd = _inotify_watch (self.dir_path)
+
+    fd = self.inotify_fd
+    if fd is None:
+      sleep (self.interval)
+      return
+
+    # Changes made by remote nodes (as in NFS) don't generate events, so
+    # keep honoring the stat interval.
+    name = os.fsencode (os.path.basename (self.path))
+    deadline = monotonic () + self.interval
+    while True:
+      timeout = deadline - monotonic ()
+      if (timeout <= 0 or not select ((fd,), (), (), timeout)[0] or
+          name in _inotify_names (fd)):
+        return
+
   def target_wait (self):
-    sleep (self.interval)
+    self._wait_change ()
     prev = self._last_modified
     try:
       with open (self.path, 'rb') as file:
-        _, uid = unpack ("<Q32s", file.read (40))
+        (_, uid), _ = _read_stored (file, False)
         self._last_modified = os.fstat(file.fileno ()).st_mtime
         return uid != self.unique_id and (
             (prev is None) or (self._last_modified > prev))
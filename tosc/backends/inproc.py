@@ -1,11 +1,15 @@
 from .base import BaseBackend
 import threading
 
+# Maximum time in seconds to wait for a change.
+_WAIT_TIMEOUT = 5
+
 class InprocData:
   def __init__ (self):
     self.version = 0
     self.lock = threading.RLock ()
-    self.cond = threading.Condition (self.lock)
+    # Event that is set (and replaced) once the current version changes.
+    self.event = threading.Event ()
     self.bvec = None
     self.notifier = None
 
@@ -28,7 +32,9 @@ class InprocBackend (BaseBackend):
     data.bvec = new
     data.version += 1
     data.notifier = self.unique_id
-    data.cond.notify_all ()
+    event = data.event
+    data.event = threading.Event ()
+    event.set ()
     return data.version
 
   def write (self, new):
@@ -48,11 +54,14 @@ class InprocBackend (BaseBackend):
 
   def target_wait (self):
     data = self.data
-    version = data.version
+    with data.lock:
+      version = data.version
+      event = data.event
+
+    if not event.wait (_WAIT_TIMEOUT):
+      return False
 
     with data.lock:
-      while version == data.version:
-        data.cond.wait (0.2)
       return version < data.version and data.notifier != self.unique_id
 
   def exclusive_lock (self):
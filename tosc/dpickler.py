@@ -1,7 +1,8 @@
 from .dtypes import *
 
 import io
-from pickle import (dumps, loads, Pickler, Unpickler)
+from pickle import dumps, loads, Pickler, Unpickler
+from weakref import WeakValueDictionary
 
 _DBUILTIN_MAP = {
   list: DList,
@@ -10,17 +11,38 @@ _DBUILTIN_MAP = {
   bytearray: DByteArray,
 }
 
+# Distributed types that were created by '_make_any', indexed by the
+# original type and the attribute names. The entries only live as long as
+# the distributed types do: These derive from the original types, so they
+# would keep them alive forever otherwise.
+_ANY_TYPES = WeakValueDictionary ()
+
 def _make_any (typ, attrs, dmgr, values):
   if values is None:
     values = DList (list (attrs.values ()))
     dmgr.link (values)
 
-  descriptors = {k: DDescriptor (values, index)
-                 for index, k in enumerate (attrs)}
+  key = (typ, tuple (attrs))
+  ntype = _ANY_TYPES.get (key)
+  if ntype is None:
+    descriptors = {k: DDescriptor (index) for index, k in enumerate (attrs)}
+    # The values are kept in a slot so they don't show up in the instance
+    # dictionary. This fails for types that can't have slots (i.e: those
+    # derived from 'int'), whose instances end up storing them there.
+    descriptors['__slots__'] = ('_dvalues',)
+    try:
+      ntype = type ("distributed-" + typ.__name__, (typ, DAny), descriptors)
+    except TypeError:
+      del descriptors['__slots__']
+      ntype = type ("distributed-" + typ.__name__, (typ, DAny), descriptors)
+
+    # From here on, '__slots__' lists the distributed attributes.
+    ntype.__slots__ = key[1]
+    ntype = _ANY_TYPES.setdefault (key, ntype)
 
-  ntype = type ("distributed-" + typ.__name__, (typ, DAny), descriptors)
-  ntype.__slots__ = tuple (descriptors.keys ())
-  return ntype.__new__ (ntype)
+  ret = ntype.__new__ (ntype)
+  ret._dvalues = values
+  return ret
 
 def _make_xmethod (method):
   return lambda self, *args, **kwargs: method (self.subobj, *args, **kwargs)
@@ -47,37 +69,45 @@ def _make_xtype (bvec):
 # since they are called a lot.
 _DTYPES = (DList, DSet, DDict, DByteArray, DObject, _make_any, _make_xtype)
 
+# The persistent ID hook is called for every pickled object, so map the
+# above by identity; since they live as long as the module, their IDs
+# cannot be reused by any other object.
+_DTYPE_IDS = {id (typ): index for index, typ in enumerate (_DTYPES)}
+
+# Payloads are shared by every process using the backend, so the protocol
+# is pinned rather than following the running Python's newest one. Version
+# 5 is the first one with out-of-band buffers.
+_PROTOCOL = 5
+
 class DPickler (Pickler):
-  def __init__ (self, fileobj, dmgr):
-    super().__init__ (fileobj)
+  def __init__ (self, fileobj, dmgr, buffer_callback = None):
+    super().__init__ (fileobj, _PROTOCOL,
+                      buffer_callback = buffer_callback)
     self.dmgr = dmgr
 
   def persistent_id (self, obj):
-    if obj is self.dmgr:
+    ret = _DTYPE_IDS.get (id (obj))
+    if ret is None and obj is self.dmgr:
       return -1
-
-    try:
-      return _DTYPES.index (obj)
-    except (ValueError, TypeError):
-      pass
+    return ret
 
 class DUnpickler (Unpickler):
-  def __init__ (self, fileobj, dmgr):
-    super().__init__ (fileobj)
+  def __init__ (self, fileobj, dmgr, buffers = None):
+    super().__init__ (fileobj, buffers = buffers)
     self.dmgr = dmgr
 
   def persistent_load (self, pid):
     if pid == -1:
       return self.dmgr
-
-    try:
+    elif 0 <= pid < len (_DTYPES):
       return _DTYPES[pid]
-    except IndexError:
-      pass
 
 def _obj_attrs (obj):
   ret = getattr (obj, '__slots__', None)
   if ret is not None:
+    if isinstance (ret, str):
+      # A single string names a single slot.
+      ret = (ret,)
     return {k: getattr (obj, k) for k in ret}
 
   ret = getattr (obj, '__dict__', None)
@@ -127,9 +157,8 @@ def make_pickable (obj, dmgr):
     # The MRO looks something like this: [..., actual-type, DAny, object]
     # As such, index -3 is the one to fetch to get the desired type.
     ty = ty.__mro__[-3]
-    slots = getattr (obj, '__slots__', None)
-    if slots:
-      values = getattr(type (obj), slots[0]).values
+    if getattr (obj, '__slots__', None):
+      values = obj._dvalues
 
   try:
     return _Wrapper (ty, _obj_attrs (obj), dmgr, values)
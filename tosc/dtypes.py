@@ -1,7 +1,10 @@
-from copy import copy as shallow_copy, deepcopy
+from copy import deepcopy
+from pickle import PickleBuffer
+import types
 
 class DObject:
   BASE_TYPE = object
+  __slots__ = ('subobj', 'dmgr', 'xid', 'version', '__weakref__')
 
   def __init__ (self, subobj, xid = 0, dmgr = None):
     if isinstance (subobj, DObject):
@@ -46,41 +49,22 @@ def _ensure_latest_subobj (self):
       self.version = version
       return subobj
 
-def _call_with_latest (self, method, args, kwargs):
-  dmgr = self.dmgr
-  if dmgr is None:
-    return method (self.subobj, *args, **kwargs)
-
-  oget = dmgr.objmap.get
-  xid = self.xid
-
-  if self.version == dmgr.version:
-    # Fast path: The version is up to date.
-    d_obj = oget (xid)
-    trace = False
-    prev = None
-
-    if d_obj is None:
-      # ... But the object was detached.
-      self.dmgr = None
-      return method (self.subobj, *args, **kwargs)
-    elif not dmgr.is_dirty (self):
-      # Sub-object hasn't changed - Make a copy.
-      prev = self.subobj
-      self.subobj = shallow_copy (prev)
-      trace = True
-
-    ret = method (self.subobj, *args, **kwargs)
-    if trace:
-      with dmgr.transaction () as tr:
-        tr.trace_obj (self, prev)
-
-    return ret
+def _trace (dmgr, obj, prev):
+  tr = dmgr.cur_trans
+  if tr is not None:
+    # Already in a transaction, which will commit the change.
+    tr.trace_obj (obj, prev)
+  else:
+    # Run an implicit transaction that commits right away.
+    with dmgr.transaction () as tr:
+      tr.trace_obj (obj, prev)
 
+def _call_with_latest_slow (self, dmgr, method, args, kwargs):
   # We must atomically update the object and then run the method.
+  oget = dmgr.objmap.get
   version = dmgr.version
   while True:
-    d_obj = oget (xid)
+    d_obj = oget (self.xid)
     if d_obj is None:
       # Object was detached.
       self.dmgr = None
@@ -89,30 +73,69 @@ def _call_with_latest (self, method, args, kwargs):
     subobj = d_obj.subobj
     if version != dmgr.version:
       version = dmgr.version
+      oget = dmgr.objmap.get
       continue
 
     self.version = version
     prev = subobj
-    self.subobj = shallow_copy (subobj)
+    self.subobj = subobj.copy ()
     ret = method (self.subobj, *args, **kwargs)
-    with dmgr.transaction () as tr:
-      tr.trace_obj (self, prev)
-      return ret
+    _trace (dmgr, self, prev)
+    return ret
+
+def _call_with_latest (self, method, args, kwargs):
+  dmgr = self.dmgr
+  if dmgr is None:
+    return method (self.subobj, *args, **kwargs)
+  elif self.version != dmgr.version:
+    return _call_with_latest_slow (self, dmgr, method, args, kwargs)
+
+  # Fast path: The version is up to date.
+  xid = self.xid
+  if dmgr.objmap.get (xid) is None:
+    # ... But the object was detached.
+    self.dmgr = None
+    return method (self.subobj, *args, **kwargs)
+
+  # Same as 'dmgr.is_dirty (self)', minus the calls.
+  tr = dmgr.cur_trans
+  if tr is not None and xid in tr.objs:
+    # Already traced: The sub-object is our own copy.
+    return method (self.subobj, *args, **kwargs)
+
+  # Sub-object hasn't changed - Make a copy. All the builtin base
+  # types implement 'copy', which avoids the generic copy protocol.
+  prev = self.subobj
+  self.subobj = prev.copy ()
+  ret = method (self.subobj, *args, **kwargs)
+  _trace (dmgr, self, prev)
+  return ret
 
 def _make_method (attr, is_op):
+  # The version check is inlined so that up-to-date objects (the common
+  # case) don't pay for a call to '_ensure_latest_subobj'.
   if is_op:
-    # Operators need to be handled separatedly, as their argument list may be
-    # swapped and because they need to work on the underlying subobject for
-    # both arguments.
+    # Operators need to be handled separatedly, because they need to work
+    # on the underlying subobject for both arguments. Note that 'self' is
+    # always distributed, even for the reflected variants.
     def _inner (self, arg):
       if isinstance (arg, DObject):
-        arg = _ensure_latest_subobj (arg)
-      if isinstance (self, DObject):
-        self = _ensure_latest_subobj (self)
-      return attr (self, arg)
+        dmgr = arg.dmgr
+        if dmgr is None or arg.version == dmgr.version:
+          arg = arg.subobj
+        else:
+          arg = _ensure_latest_subobj (arg)
+
+      dmgr = self.dmgr
+      if dmgr is None or self.version == dmgr.version:
+        return attr (self.subobj, arg)
+      return attr (_ensure_latest_subobj (self), arg)
     return _inner
 
   def _inner (self, *args, **kwargs):
+    dmgr = self.dmgr
+    if dmgr is None or self.version == dmgr.version:
+      return attr (self.subobj, *args, **kwargs)
     return attr (_ensure_latest_subobj (self), *args, **kwargs)
   return _inner
 
@@ -137,17 +160,66 @@ _MUTABLES = ('append', 'clear', 'extend', 'insert', 'pop', 'remove',
              'add', 'symmetric_difference_update', 'difference_update',
              'intersection_update', 'discard',   # set
              '__setitem__', '__delitem__', '__iadd__', '__imul__',
-             '__iand__', '__ior__', '__ixor__')
-
-def _make_dbuiltin (base, name, dcopy = None):
-  ret = type (name, (DObject,), {})
-  for elem in dir (base):
-    if elem in _SKIP_ATTRS:
-      continue
-    attr = getattr (base, elem)
-    stype = str (type (attr))
-    if 'wrapper' not in stype and 'method' not in stype:
-      # Attribute is not a methor or method-wrapper - Skip.
+             '__iand__', '__ior__', '__isub__', '__ixor__')
+
+# The instance methods that are forwarded for each builtin base type.
+# Class-level methods (i.e: 'dict.fromkeys') and '__delattr__' are left
+# out on purpose. Methods missing in older Python versions are skipped.
+_COMMON_ATTRS = ('__contains__', '__dir__', '__eq__', '__format__',
+                 '__ge__', '__gt__', '__iter__', '__le__', '__len__',
+                 '__lt__', '__ne__', '__repr__', '__sizeof__', '__str__',
+                 'clear', 'copy')
+
+_LIST_ATTRS = _COMMON_ATTRS + (
+  '__add__', '__delitem__', '__getitem__', '__iadd__', '__imul__',
+  '__mul__', '__reversed__', '__rmul__', '__setitem__', 'append',
+  'count', 'extend', 'index', 'insert', 'pop', 'remove', 'reverse', 'sort')
+
+_SET_ATTRS = _COMMON_ATTRS + (
+  '__and__', '__iand__', '__ior__', '__isub__', '__ixor__', '__or__',
+  '__rand__', '__ror__', '__rsub__', '__rxor__', '__sub__', '__xor__',
+  'add', 'difference', 'difference_update', 'discard', 'intersection',
+  'intersection_update', 'isdisjoint', 'issubset', 'issuperset', 'pop',
+  'remove', 'symmetric_difference', 'symmetric_difference_update',
+  'union', 'update')
+
+_DICT_ATTRS = _COMMON_ATTRS + (
+  '__delitem__', '__getitem__', '__ior__', '__or__', '__reversed__',
+  '__ror__', '__setitem__', 'get', 'items', 'keys', 'pop', 'popitem',
+  'setdefault', 'update', 'values')
+
+_BYTEARRAY_ATTRS = _COMMON_ATTRS + (
+  # The buffer protocol is only exposed to Python code since 3.12.
+  '__buffer__', '__release_buffer__',
+  '__add__', '__alloc__', '__delitem__', '__getitem__', '__iadd__',
+  '__imul__', '__mod__', '__mul__', '__rmod__', '__rmul__', '__setitem__',
+  'append', 'capitalize', 'center', 'count', 'decode', 'endswith',
+  'expandtabs', 'extend', 'find', 'hex', 'index', 'insert', 'isalnum',
+  'isalpha', 'isascii', 'isdigit', 'islower', 'isspace', 'istitle',
+  'isupper', 'join', 'ljust', 'lower', 'lstrip', 'partition', 'pop',
+  'remove', 'removeprefix', 'removesuffix', 'replace', 'reverse', 'rfind',
+  'rindex', 'rjust', 'rpartition', 'rsplit', 'rstrip', 'split',
+  'splitlines', 'startswith', 'strip', 'swapcase', 'title', 'translate',
+  'upper', 'zfill')
+
+_METHOD_TYPES = (types.WrapperDescriptorType, types.MethodDescriptorType,
+                 types.BuiltinMethodType, types.MethodWrapperType,
+                 types.ClassMethodDescriptorType)
+
+def _scan_attrs (base):
+  # Generic fallback for types without an explicit list of attributes.
+  return [elem for elem in dir (base) if elem not in _SKIP_ATTRS and
+          isinstance (getattr (base, elem), _METHOD_TYPES)]
+
+def _make_dbuiltin (base, name, dcopy = None, attrs = None, state = None):
+  ret = type (name, (DObject,), {'__slots__': ()})
+  if attrs is None:
+    attrs = _scan_attrs (base)
+
+  for elem in attrs:
+    attr = getattr (base, elem, None)
+    if attr is None:
+      # Not available in this Python version.
       continue
     elif elem in _MUTABLES:
       setattr (ret, elem, _make_mutable_method (attr))
@@ -155,39 +227,69 @@ def _make_dbuiltin (base, name, dcopy = None):
       setattr (ret, elem, _make_method (attr, elem in _OPERATORS))
 
   ret.BASE_TYPE = base
+  copy = getattr (base, 'copy', None)
+  if copy is not None:
+    # Like 'copy', return a copy of the underlying (non-distributed) object.
+    ret.__copy__ = _make_method (copy, False)
   if dcopy is not None:
     ret.__deepcopy__ = dcopy
+  if state is not None:
+    # Custom pickling hooks, as a (getstate, setstate) pair.
+    ret.__getstate__, ret.__setstate__ = state
 
   return ret
 
+# Types that 'deepcopy' returns as-is. Checking for them up front saves
+# a call (and its dispatch) for what are usually most of the elements.
+_ATOMIC_TYPES = frozenset ((type (None), bool, int, float, complex, str,
+                            bytes, type, range, types.FunctionType))
+
 def _deepcopy_dlist (self, memo):
   ret = []
   memo[id (self)] = ret
-  for elem in self:
-    ret.append (deepcopy (elem, memo))
+  append = ret.append
+  for elem in _ensure_latest_subobj (self):
+    append (elem if type (elem) in _ATOMIC_TYPES else deepcopy (elem, memo))
   return ret
 
 def _deepcopy_dset (self, memo):
   ret = set ()
   memo[id (self)] = ret
-  for elem in self:
-    ret.add (deepcopy (elem, memo))
+  add = ret.add
+  for elem in _ensure_latest_subobj (self):
+    add (elem if type (elem) in _ATOMIC_TYPES else deepcopy (elem, memo))
   return ret
 
 def _deepcopy_ddict (self, memo):
   ret = {}
   memo[id (self)] = ret
-  for k, v in self.items ():
-    ret[deepcopy (k, memo)] = deepcopy (v, memo)
+  for k, v in _ensure_latest_subobj(self).items ():
+    if type (k) not in _ATOMIC_TYPES:
+      k = deepcopy (k, memo)
+    ret[k] = v if type (v) in _ATOMIC_TYPES else deepcopy (v, memo)
   return ret
 
 def _deepcopy_dbytearray (self, _):
   return self.subobj.copy ()
 
-DList = _make_dbuiltin (list, 'DList', _deepcopy_dlist)
-DSet = _make_dbuiltin (set, 'DSet', _deepcopy_dset)
-DDict = _make_dbuiltin (dict, 'DDict', _deepcopy_ddict)
-DByteArray = _make_dbuiltin (bytearray, 'DByteArray', _deepcopy_dbytearray)
+def _getstate_dbytearray (self):
+  # Wrapping the byte array lets the pickler move it out-of-band.
+  return (PickleBuffer (self.subobj), self.xid, self.dmgr)
+
+def _setstate_dbytearray (self, state):
+  subobj, self.xid, self.dmgr = state
+  if type (subobj) is not bytearray:
+    # Out-of-band buffers are received as-is.
+    subobj = bytearray (subobj)
+  self.subobj = subobj
+  self.dmgr.link (self)
+
+DList = _make_dbuiltin (list, 'DList', _deepcopy_dlist, _LIST_ATTRS)
+DSet = _make_dbuiltin (set, 'DSet', _deepcopy_dset, _SET_ATTRS)
+DDict = _make_dbuiltin (dict, 'DDict', _deepcopy_ddict, _DICT_ATTRS)
+DByteArray = _make_dbuiltin (bytearray, 'DByteArray', _deepcopy_dbytearray,
+                             _BYTEARRAY_ATTRS, (_getstate_dbytearray,
+                                                _setstate_dbytearray))
 
 class DAny:
   """
@@ -213,19 +315,22 @@ class DAny:
 class DDescriptor:
   """
   Distributed descriptor. Instances of this class represent the attributes of
-  instances of the type 'DAny'. The only important bit of note is that the
-  '__set__' method calls out to the distributed manager to notify of changes.
+  instances of the type 'DAny'. The values themselves are stored in a
+  distributed list that is kept in each instance, so that the type (and its
+  descriptors) can be shared by all the instances with the same attributes.
+  Since that list is distributed, '__set__' notifies the manager of changes.
   """
 
-  def __init__ (self, values, index):
-    self.values = values
+  __slots__ = ('index',)
+
+  def __init__ (self, index):
     self.index = index
 
   def __get__ (self, obj, _):
-    return self if obj is None else self.values[self.index]
+    return self if obj is None else obj._dvalues[self.index]
 
-  def __set__ (self, _, value):
-    self.values[self.index] = value
+  def __set__ (self, obj, value):
+    obj._dvalues[self.index] = value
 
 class DXtype (DObject):
   "Base type for distributed extension types."
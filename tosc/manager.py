@@ -3,30 +3,54 @@ from .transaction import Transaction
 
 from copy import deepcopy
 import io
+import itertools
+from struct import pack, unpack_from
 import threading
 import uuid
 import weakref
 
 NIL = object ()
 
+# Byte arrays at least this large are kept out of the pickle stream.
+_OOB_MIN_SIZE = 64 * 1024
+
+# Leading byte for payloads that carry out-of-band buffers. Plain pickle
+# streams start with the PROTO opcode instead (0x80).
+_OOB_TAG = 0
+
 class Manager:
-  def __init__ (self, backend):
-    self.unique_id = str(uuid.uuid4 ()).replace('-', '').encode ('utf8')
+  def __init__ (self, backend, skip_unchanged = False):
+    self.unique_id = uuid.uuid4().hex.encode ('ascii')
     self.backend = backend
     self.backend.set_id (self.unique_id)
-    self.iov = io.BytesIO ()
+    # Writers don't hold the lock while pickling, so each thread gets its
+    # own output buffer.
+    self._iov_tls = threading.local ()
     self.root_obj = NIL
-    self._xid = 1
+    self._xid_iter = itertools.count (1)
     self.objmap = {}
     self.new_objmap = self.objmap
     self.cur_trans = None
+    # This lock serializes the writers of the state above: starting a
+    # transaction, installing a new root object and the watcher thread.
+    # Reads that go to the backend ('refresh', or 'read' with nothing
+    # cached) take it when they start their transaction, but returning
+    # an already cached root and checking the versions of objects don't.
     self.lock = threading.Lock ()
     self.needs_update = False
     self.version = 0
+    # Whether transactions that leave every traced object equal to its
+    # previous value skip writing to the backend.
+    self.skip_unchanged = skip_unchanged
     self._saved_tr = Transaction (self)
+    # Set when this Manager is collected, so that the watcher exits after
+    # its current wait instead of polling a dead reference.
+    self._stop = threading.Event ()
     self.watcher = threading.Thread (target = self.watcher_target,
-                                     args = (weakref.ref (self),),
+                                     args = (weakref.ref (self), backend,
+                                             self.lock, self._stop),
                                      daemon = True)
+    weakref.finalize (self, self._stop.set)
     self.watcher.start ()
 
   @property
@@ -35,9 +59,8 @@ class Manager:
     Return a unique identifier for a distributed object, but only from
     this Manager's point of view.
     """
-    ret = self._xid
-    self._xid += 1
-    return ret
+    # Advancing the counter is atomic, so concurrent links can't race.
+    return next (self._xid_iter)
 
   def is_linked (self, obj):
     """
@@ -55,24 +78,31 @@ class Manager:
             tr.is_traced (obj))
 
   @staticmethod
-  def watcher_target (wself):
+  def watcher_target (wself, backend, lock, stop):
     """
     Watch for changes on the underlying backend from a separate thread.
     """
-    while True:
+    # Only hold a strong reference to the Manager while handling a change,
+    # never while waiting on the backend. That's also why the backend and
+    # the lock are passed in, rather than any bound method.
+    while not stop.is_set ():
+      if not backend.target_wait () or stop.is_set ():
+        continue
+
       self = wself ()
       if self is None:
         return
 
-      if self.backend.target_wait ():
-        with self.lock:
-          if self.cur_trans is not None:
-            # If a transaction is in flight, simply mark the current
-            # status as needing an update.
-            self.needs_update = True
-          else:
-            # Otherwise, refresh the root object.
-            self._refresh_locked (None)
+      with lock:
+        if self.cur_trans is not None:
+          # If a transaction is in flight, simply mark the current
+          # status as needing an update.
+          self.needs_update = True
+        else:
+          # Otherwise, refresh the root object.
+          self._refresh_locked (None)
+
+      self = None
 
   def transaction (self):
     """
@@ -140,16 +170,39 @@ class Manager:
       ret = self.refresh (dfl)
     return ret
 
+  def _get_iov (self):
+    try:
+      return self._iov_tls.iov
+    except AttributeError:
+      iov = self._iov_tls.iov = io.BytesIO ()
+      return iov
+
   def _payload (self, obj):
-    iov = self.iov
+    iov = self._get_iov ()
     iov.seek (0)
     iov.truncate (0)
-    DPickler(iov, self).dump (make_pickable (obj, self))
-    return iov.getvalue ()
+    buffers = []
+
+    def _buffer_cb (buf):
+      buf = buf.raw ()
+      if buf.nbytes < _OOB_MIN_SIZE:
+        return True   # Serialize in-band.
+      buffers.append (buf)
+
+    DPickler(iov, self, _buffer_cb).dump (make_pickable (obj, self))
+    if not buffers:
+      return iov.getvalue ()
+
+    # Lay out the payload as: tag, number of buffers, the lengths of the
+    # pickle stream and each buffer, and then the data itself.
+    with iov.getbuffer () as stream:
+      lens = [len (stream)] + [buf.nbytes for buf in buffers]
+      hdr = pack ("<BI%dQ" % len (lens), _OOB_TAG, len (buffers), *lens)
+      return b''.join ([hdr, stream] + buffers)
 
   def _load (self, payload):
     self.new_objmap = {}
-    return DUnpickler(io.BytesIO (payload), self).load ()
+    return self.load (payload)
 
   def _update (self, version, root):
     if version > self.version:
@@ -181,13 +234,25 @@ class Manager:
     return ret
 
   def dump (self, obj):
-    self.iov.seek (0)
-    self.iov.truncate (0)
-    DPickler(self.iov, self).dump (make_pickable (obj, self))
-    return self.iov.getvalue ()
+    return self._payload (obj)
 
   def load (self, payload = None):
-    return DUnpickler(io.BytesIO (payload), self).load ()
+    buffers = None
+    if payload[0] == _OOB_TAG:
+      view = memoryview (payload)
+      nbufs = unpack_from ("<I", view, 1)[0]
+      lens = unpack_from ("<%dQ" % (nbufs + 1), view, 5)
+      off = 5 + 8 * len (lens)
+      buffers = []
+      for size in lens:
+        buffers.append (view[off:off + size])
+        off += size
+      payload = buffers.pop (0)
+
+    # Backends may return a memoryview over their own buffer. BytesIO
+    # shares the memory of bytes objects, but copies anything else once,
+    # which is unavoidable since the unpickler needs a file object.
+    return DUnpickler(io.BytesIO (payload), self, buffers).load ()
 
   def __getstate__ (self):
     raise ValueError ('distributed managers must not be pickled')
@@ -9,9 +9,45 @@ class TransactionRetryError (Exception):
 class TransactionTimeoutError (Exception):
   pass
 
+# Types whose values are compared exactly by '_unchanged'.
+_VALUE_TYPES = (type (None), bool, int, str, bytes, bytearray)
+
+def _unchanged (new, old):
+  """
+  Test whether a sub-object is the same as its previous value. This is
+  stricter than equality, so that changes that compare equal still get
+  committed: Types have to match (as in 1 and 1.0), floats are compared
+  by representation (as in 0.0 and -0.0) and any other objects, like
+  distributed ones, must be the very same.
+  """
+  if new is old:
+    return True
+
+  typ = type (new)
+  if typ is not type (old):
+    return False
+  elif typ in _VALUE_TYPES:
+    return new == old
+  elif typ is float or typ is complex:
+    return repr (new) == repr (old)
+  elif typ is dict:
+    new, old = new.items (), old.items ()
+  elif typ not in (list, tuple, set, frozenset):
+    return False
+
+  # Elements are compared in order. This may see equal sets or dicts as
+  # different, which only means writing them anyway.
+  return len (new) == len (old) and all (
+    _unchanged (x, y) for x, y in zip (new, old))
+
 class Transaction:
+  __slots__ = ('objs', 'prevs', 'dmgr', 'depth', 'version')
+
   def __init__ (self, dmgr):
+    # The traced objects and their previous values, both indexed by ID.
+    # Since they are always updated together, they have the same order.
     self.objs = {}
+    self.prevs = {}
     self.dmgr = dmgr
     self.depth = 0
     self.version = 0
@@ -20,7 +56,9 @@ class Transaction:
     """
     Mark an object as being a part of the transaction.
     """
-    self.objs[obj.xid] = (obj, prev)
+    xid = obj.xid
+    self.objs[xid] = obj
+    self.prevs[xid] = prev
 
   def is_traced (self, obj):
     """
@@ -33,9 +71,8 @@ class Transaction:
     Undo the changes proposed by the transaction.
     """
     objmap = self.dmgr.objmap
-    for xid, prev in self.objs.items ():
-      prev_obj, prev_val = prev
-      objmap[prev_obj.xid].subobj = prev_obj.subobj = prev_val
+    for obj, prev in zip (self.objs.values (), self.prevs.values ()):
+      objmap[obj.xid].subobj = obj.subobj = prev
 
   def commit (self):
     """
@@ -46,10 +83,20 @@ class Transaction:
       return True
 
     dmgr = self.dmgr
+    if dmgr.skip_unchanged and all (
+        _unchanged (obj.subobj, prev) for obj, prev in
+        zip (objs.values (), self.prevs.values ())):
+      # Mutable methods were called, but nothing actually changed.
+      return True
+
     outmap = dmgr.objmap
 
-    for xid, val in objs.items ():
-      outmap[xid].subobj = val[0].subobj
+    # The traced object isn't necessarily the one in the object map: A
+    # handle that was obtained before a refresh keeps working and gets
+    # traced itself, while the map holds the freshly loaded object with
+    # the same ID. That's the one that gets pickled, so copy the value.
+    for xid, obj in objs.items ():
+      outmap[xid].subobj = obj.subobj
 
     try:
       ret = dmgr.try_write (dmgr.root_obj, self.version)
@@ -72,6 +119,7 @@ class Transaction:
     Remove the transaction from the underlying Manager.
     """
     self.objs.clear ()
+    self.prevs.clear ()
     self.dmgr.unlink_trans ()
 
   def __exit__ (self, exc_type, *args):
@@ -99,22 +147,19 @@ def transactional (dmgr, retries = None, timeout = None, use_lock = True):
         not isinstance (timeout, float)) or timeout < 0:
       raise ValueError ('timeout must be a positive number')
 
+  # Bound once, since it's entered on every call and every retry.
+  transaction = dmgr.transaction
+
   def _inner (fn):
-    def _f (*args, **kwargs):
+    def _retry (args, kwargs, deadline):
+      # Slow path: The first attempt failed to commit.
       num_retries = retries
       cur_time = None
-      deadline = None if timeout is None else time () + timeout
       backoff = 0.005
       long_running = False
       backend_has_xlock = dmgr.backend.can_lock ()
 
       while True:
-        try:
-          with dmgr.transaction ():
-            return fn (*args, **kwargs)
-        except TransactionError:
-          pass
-
         if num_retries is not None:
           num_retries -= 1
           if num_retries < 0:
@@ -142,5 +187,21 @@ def transactional (dmgr, retries = None, timeout = None, use_lock = True):
           except Exception:
             pass
 
+        try:
+          with transaction ():
+            return fn (*args, **kwargs)
+        except TransactionError:
+          pass
+
+    def _f (*args, **kwargs):
+      deadline = None if timeout is None else time () + timeout
+      try:
+        with transaction ():
+          return fn (*args, **kwargs)
+      except TransactionError:
+        pass
+
+      return _retry (args, kwargs, deadline)
+
     return _f
   return _inner